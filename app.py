@@ -1,8 +1,10 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
-import plotly.express as px
-from math import pow
+import plotly.graph_objects as go
 
 # --- Configuration de l'application Streamlit ---
 st.set_page_config(
@@ -24,82 +26,117 @@ if 'stock_name' not in st.session_state:
 
 # --- Fonctions de Récupération de Données ---
 
-@st.cache_data(ttl=3600) # Mise en cache des résultats pour 1 heure
-def fetch_stock_price(symbol, api_key):
+@st.cache_resource # Une seule session HTTP partagée entre les reruns (réutilisation des connexions)
+def get_http_session():
     """
-    Récupère le prix actuel d'une action en utilisant l'API Alpha Vantage.
+    Crée la session HTTP partagée utilisée pour les appels à Alpha Vantage.
+    Ne pas la modifier après coup : elle est commune à tous les utilisateurs.
+    """
+    session = requests.Session()
+    session.headers.update({"Accept": "application/json"})
+    # Pool de connexions keep-alive et nouvelles tentatives rapides sur les erreurs transitoires.
+    # Pas de nouvelle tentative après un délai de lecture dépassé, et on ignore Retry-After :
+    # le pire cas reste proche d'une dizaine de secondes pour une recherche.
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(
+            total=2,
+            read=0,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            respect_retry_after_header=False
+        )
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+def _request_quote(symbol, api_key, session):
+    """
+    Interroge l'API Alpha Vantage pour le prix actuel d'une action.
+    Fonction pure (aucun appel d'interface) : retourne (prix, nom, erreur ou None).
     """
-    if not symbol:
-        return 0.0, "--"
-    
     url = f"https://www.alphavantage.co/query?function=GLOBAL_QUOTE&symbol={symbol}&apikey={api_key}"
     
     try:
-        response = requests.get(url, timeout=10)
+        response = session.get(url, timeout=(3, 7)) # (connexion, lecture)
         response.raise_for_status() # Lève une exception pour les codes d'erreur HTTP
         data = response.json()
 
         if data.get('Global Quote') and data['Global Quote'].get('05. price'):
             price = float(data['Global Quote']['05. price'])
-            return price, symbol # L'API ne donne pas toujours un nom, on utilise le symbole
+            return price, symbol, None # L'API ne donne pas toujours un nom, on utilise le symbole
         elif data.get('Error Message'):
-            st.error(f"Erreur API: {data['Error Message']}")
-            return 0.0, symbol
+            return 0.0, symbol, f"Erreur API: {data['Error Message']}"
         else:
-            return 0.0, symbol
+            return 0.0, symbol, None
             
     except requests.exceptions.RequestException as e:
-        st.error(f"Erreur de connexion lors de la récupération des données : {e}")
+        return 0.0, "--", f"Erreur de connexion lors de la récupération des données : {e}"
+
+
+@st.cache_data(ttl=900, max_entries=128, show_spinner=False) # Cache borné, prix rafraîchis toutes les 15 minutes
+def _fetch_quote(symbol, api_key):
+    """
+    Version mise en cache de _request_quote, à appeler depuis le thread du script.
+    """
+    return _request_quote(symbol, api_key, get_http_session())
+
+
+def fetch_stock_price(symbol, api_key):
+    """
+    Récupère le prix actuel d'une action en utilisant l'API Alpha Vantage.
+    Les erreurs sont affichées ici, en dehors de la fonction mise en cache.
+    """
+    if not symbol:
         return 0.0, "--"
 
+    price, name, error = _fetch_quote(symbol, api_key)
+    if error:
+        st.error(error)
+    return price, name
+
 
 # --- Fonction de Calcul et de Projection ---
 
+# Les deux onglets projettent sur 5 ans : exposants précalculés une fois pour toutes
+_YEARS_5 = np.arange(6)
+
 def calculate_projection(start_value, growth_rate, multiple, years, desired_return, current_price, metric_label):
     """
     Calcule la juste valeur et le rendement annuel pour une projection.
     Retourne la juste valeur, le rendement actuel, et le DataFrame de projection.
     """
     try:
-        # 1. Calculer la valeur future de la métrique (EPS ou FCFPS)
-        future_metric = start_value * pow(1 + growth_rate, years)
+        # 1. Projeter la métrique (EPS ou FCFPS) et le prix pour chaque année
+        one_plus_g = 1.0 + growth_rate
+        one_plus_r = 1.0 + desired_return
+        years_arr = _YEARS_5 if years == 5 else np.arange(years + 1)
+        metric_i = start_value * one_plus_g ** years_arr
+        price_i = metric_i * multiple
 
-        # 2. Calculer le prix futur de l'action
-        future_stock_price = future_metric * multiple
+        # 2. Prix futur de l'action (dernière année de la projection)
+        future_stock_price = price_i[-1]
 
         # 3. Calculer le prix d'entrée (Juste Valeur) pour le rendement souhaité
-        just_value = future_stock_price / pow(1 + desired_return, years)
+        just_value = future_stock_price / one_plus_r ** years
 
         # 4. Calculer le rendement annuel actuel
         current_annual_return = 0.0
         if current_price > 0:
-            current_annual_return = (pow(future_stock_price / current_price, 1/years) - 1) * 100
-        
-        # 5. Créer le DataFrame de projection pour le graphique
-        projection_data = []
-        for year in range(years + 1):
-            if year == 0:
-                price_i = current_price if current_price > 0 else 0
-                metric_i = start_value
-            else:
-                metric_i = start_value * pow(1 + growth_rate, year)
-                price_i = metric_i * multiple
-            
-            projection_data.append({
-                "Année": year,
-                "Prix Projeté": price_i,
-                metric_label: metric_i,
-                "Type": "Prix Projeté",
-            })
-        
-        df = pd.DataFrame(projection_data)
+            current_annual_return = ((future_stock_price / current_price) ** (1 / years) - 1) * 100
         
-        # Ajout du prix futur cible et du prix actuel pour le graphique
-        df_cible = pd.DataFrame([
-            {"Année": 0, "Prix Projeté": current_price, metric_label: 0, "Type": "Prix Actuel"},
-            {"Année": years, "Prix Projeté": future_stock_price, metric_label: 0, "Type": "Prix Cible"}
-        ])
-        df = pd.concat([df, df_cible]).sort_values("Année").reset_index(drop=True)
+        # 5. Créer le DataFrame de projection pour le graphique, en un seul appel :
+        # projection année 0, prix actuel, projection années 1 à N, puis prix cible (année N).
+        # Même ordre que l'ancien concat + tri par année.
+        price_i[0] = current_price if current_price > 0 else 0
+        df = pd.DataFrame({
+            "Année": np.concatenate(([0, 0], years_arr[1:], [years])),
+            "Prix Projeté": np.concatenate(([price_i[0], current_price], price_i[1:], [future_stock_price])),
+            metric_label: np.concatenate(([metric_i[0], 0.0], metric_i[1:], [0.0])),
+            "Type": ["Prix Projeté", "Prix Actuel"] + ["Prix Projeté"] * years + ["Prix Cible"],
+        })
 
         return just_value, current_annual_return, df
     
@@ -108,6 +145,49 @@ def calculate_projection(start_value, growth_rate, multiple, years, desired_retu
         return 0.0, 0.0, pd.DataFrame()
 
 
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False) # Évite de recalculer la projection et le graphique à paramètres identiques
+def build_projection_figure(start_value, growth_rate, multiple, years, desired_return, current_price, metric_label, title):
+    """
+    Calcule la projection et construit le graphique Plotly associé.
+    Retourne la juste valeur, le rendement actuel, et la figure sous forme de dict
+    (None si la projection a échoué).
+    """
+    just_value, current_annual_return, df = calculate_projection(
+        start_value=start_value,
+        growth_rate=growth_rate,
+        multiple=multiple,
+        years=years,
+        desired_return=desired_return,
+        current_price=current_price,
+        metric_label=metric_label
+    )
+
+    if df.empty:
+        return just_value, current_annual_return, None
+
+    # Création du graphique Plotly : une trace WebGL par type de prix
+    fig = go.Figure()
+    # Ordre explicite des traces : la projection garde la première couleur et la tête de légende
+    for price_type in ("Prix Projeté", "Prix Actuel", "Prix Cible"):
+        group = df[df["Type"] == price_type]
+        fig.add_trace(go.Scattergl(
+            x=group["Année"],
+            y=group["Prix Projeté"],
+            mode="lines+markers",
+            name=price_type,
+            hovertemplate=f"Type={price_type}<br>Année=%{{x}}<br>Prix Projeté=%{{y}}<extra></extra>"
+        ))
+
+    fig.update_layout(
+        title=title,
+        xaxis_title="Année",
+        yaxis_title="Prix Projeté",
+        legend_title_text="Type"
+    )
+
+    return just_value, current_annual_return, fig.to_dict()
+
+
 # --- Interface Utilisateur Streamlit ---
 
 st.title("Calculateur de Juste Valeur (DCF)")
@@ -120,11 +200,12 @@ st.header("1. Prix de l'action")
 col1, col2 = st.columns([3, 1])
 
 with col1:
-    symbol = st.text_input("Symbole Boursier (Ticker) :", value="AAPL", max_chars=10).strip().upper()
+    symbol_raw = st.text_input("Symbole Boursier (Ticker) :", value="AAPL", max_chars=10, key="symbol_raw")
 
 with col2:
     st.markdown("<!-- Espace pour aligner le bouton -->")
     if st.button("Rechercher le prix"):
+        symbol = symbol_raw.strip().upper()
         with st.spinner(f"Récupération du prix pour {symbol}..."):
             price, name = fetch_stock_price(symbol, ALPHA_VANTAGE_API_KEY)
             st.session_state.current_price = price
@@ -142,36 +223,47 @@ manual_price = st.number_input(
     format="%.2f",
     key="manual_price_input"
 )
-st.session_state.current_price = manual_price
+# Évite de réécrire l'état de session quand le prix n'a pas changé
+if manual_price != st.session_state.current_price:
+    st.session_state.current_price = manual_price
 
 
 # --- Section 2: Onglets d'évaluation ---
 
-tab_eps, tab_fcf = st.tabs(["Bénéfice par Action (BPA/EPS)", "Flux de Trésorerie Disponibles (FCF)"])
+# Chaque onglet est un fragment : une interaction avec ses widgets ne réexécute
+# que cet onglet, pas l'autre ni la récupération du prix.
 
-# --- Onglet BPA (EPS) ---
-with tab_eps:
+@st.fragment
+def render_eps_tab(current_price):
+    """
+    Affiche les paramètres, les résultats et le graphique de l'évaluation BPA.
+    """
     st.subheader("Paramètres d'évaluation BPA")
 
-    col_a, col_b = st.columns(2)
-    
-    eps = col_a.number_input("Bénéfice par action (BPA/EPS):", value=7.50, min_value=0.0, format="%.2f", key="eps")
-    eps_growth = col_b.slider("Taux de croissance du BPA (annuel, %):", min_value=1.0, max_value=25.0, value=10.0, step=0.1, key="eps_growth")
-    
-    pe_multiple = col_a.number_input("Multiple P/E approprié (Poids):", value=20.0, min_value=1.0, format="%.1f", key="pe_multiple")
-    desired_return_eps = col_b.slider("Rendement annuel souhaité (%):", min_value=5.0, max_value=30.0, value=15.0, step=0.5, key="desired_return_eps")
+    # Les paramètres ne sont pris en compte qu'à la validation du formulaire
+    with st.form("eps_params"):
+        col_a, col_b = st.columns(2)
+
+        eps = col_a.number_input("Bénéfice par action (BPA/EPS):", value=7.50, min_value=0.0, format="%.2f", key="eps")
+        eps_growth = col_b.slider("Taux de croissance du BPA (annuel, %):", min_value=1.0, max_value=25.0, value=10.0, step=0.1, key="eps_growth")
+
+        pe_multiple = col_a.number_input("Multiple P/E approprié (Poids):", value=20.0, min_value=1.0, format="%.1f", key="pe_multiple")
+        desired_return_eps = col_b.slider("Rendement annuel souhaité (%):", min_value=5.0, max_value=30.0, value=15.0, step=0.5, key="desired_return_eps")
+
+        st.form_submit_button("Calculer")
     
     years = 5 # Nombre d'années de projection fixé
 
     # Calcul
-    just_value_eps, current_return_eps, df_eps = calculate_projection(
+    just_value_eps, current_return_eps, fig_eps = build_projection_figure(
         start_value=eps,
         growth_rate=eps_growth / 100,
         multiple=pe_multiple,
         years=years,
         desired_return=desired_return_eps / 100,
-        current_price=st.session_state.current_price,
-        metric_label="EPS Projeté"
+        current_price=current_price,
+        metric_label="EPS Projeté",
+        title="Projection du Prix de l'Action (basée sur le BPA)"
     )
 
     st.markdown("---")
@@ -192,49 +284,41 @@ with tab_eps:
         delta_color="normal" if current_return_eps >= desired_return_eps else "inverse"
     )
 
-    if not df_eps.empty:
-        # Création du graphique Plotly
-        fig_eps = px.line(
-            df_eps, 
-            x="Année", 
-            y="Prix Projeté", 
-            color="Type",
-            title="Projection du Prix de l'Action (basée sur le BPA)",
-            markers=True
-        )
-        
-        # Mise en évidence des points de départ et de fin
-        fig_eps.update_traces(
-            marker=dict(size=8), 
-            selector=dict(mode='markers+lines')
-        )
-        
-        st.plotly_chart(fig_eps, use_container_width=True)
+    if fig_eps is not None:
+        st.plotly_chart(go.Figure(fig_eps), use_container_width=True)
 
 
-# --- Onglet FCF (Flux de Trésorerie Disponibles) ---
-with tab_fcf:
+@st.fragment
+def render_fcf_tab(current_price):
+    """
+    Affiche les paramètres, les résultats et le graphique de l'évaluation FCF.
+    """
     st.subheader("Paramètres d'évaluation FCF")
     
-    col_a, col_b = st.columns(2)
-    
-    fcfps = col_a.number_input("FCF par action (FCFPS):", value=39.50, min_value=0.0, format="%.2f", key="fcfps")
-    fcf_growth = col_b.slider("Taux de croissance du FCF (annuel, %):", min_value=1.0, max_value=25.0, value=10.0, step=0.1, key="fcf_growth")
-    
-    pfcf_multiple = col_a.number_input("Multiple P/FCF approprié:", value=25.0, min_value=1.0, format="%.1f", key="pfcf_multiple")
-    desired_return_fcf = col_b.slider("Rendement annuel souhaité (%):", min_value=5.0, max_value=30.0, value=15.0, step=0.5, key="desired_return_fcf")
+    # Les paramètres ne sont pris en compte qu'à la validation du formulaire
+    with st.form("fcf_params"):
+        col_a, col_b = st.columns(2)
+
+        fcfps = col_a.number_input("FCF par action (FCFPS):", value=39.50, min_value=0.0, format="%.2f", key="fcfps")
+        fcf_growth = col_b.slider("Taux de croissance du FCF (annuel, %):", min_value=1.0, max_value=25.0, value=10.0, step=0.1, key="fcf_growth")
+
+        pfcf_multiple = col_a.number_input("Multiple P/FCF approprié:", value=25.0, min_value=1.0, format="%.1f", key="pfcf_multiple")
+        desired_return_fcf = col_b.slider("Rendement annuel souhaité (%):", min_value=5.0, max_value=30.0, value=15.0, step=0.5, key="desired_return_fcf")
+
+        st.form_submit_button("Calculer")
     
     years = 5 # Nombre d'années de projection fixé
 
     # Calcul
-    just_value_fcf, current_return_fcf, df_fcf = calculate_projection(
+    just_value_fcf, current_return_fcf, fig_fcf = build_projection_figure(
         start_value=fcfps,
         growth_rate=fcf_growth / 100,
         multiple=pfcf_multiple,
         years=years,
         desired_return=desired_return_fcf / 100,
-        current_price=st.session_state.current_price,
-        metric_label="FCFPS Projeté"
+        current_price=current_price,
+        metric_label="FCFPS Projeté",
+        title="Projection du Prix de l'Action (basée sur le FCF)"
     )
 
     st.markdown("---")
@@ -255,21 +339,16 @@ with tab_fcf:
         delta_color="normal" if current_return_fcf >= desired_return_fcf else "inverse"
     )
 
-    if not df_fcf.empty:
-        # Création du graphique Plotly
-        fig_fcf = px.line(
-            df_fcf, 
-            x="Année", 
-            y="Prix Projeté", 
-            color="Type",
-            title="Projection du Prix de l'Action (basée sur le FCF)",
-            markers=True
-        )
-        
-        # Mise en évidence des points de départ et de fin
-        fig_fcf.update_traces(
-            marker=dict(size=8), 
-            selector=dict(mode='markers+lines')
-        )
-        
-        st.plotly_chart(fig_fcf, use_container_width=True)
+    if fig_fcf is not None:
+        st.plotly_chart(go.Figure(fig_fcf), use_container_width=True)
+
+
+tab_eps, tab_fcf = st.tabs(["Bénéfice par Action (BPA/EPS)", "Flux de Trésorerie Disponibles (FCF)"])
+
+# --- Onglet BPA (EPS) ---
+with tab_eps:
+    render_eps_tab(st.session_state.current_price)
+
+# --- Onglet FCF (Flux de Trésorerie Disponibles) ---
+with tab_fcf:
+    render_fcf_tab(st.session_state.current_price)